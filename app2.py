@@ -3,8 +3,12 @@ import pandas as pd
 import plotly.express as px
 import os
 from utils.merge import merge_uploaded_files
-from utils.distribute import distribute_keywords
-from utils.generator import detect_columns, generate_keywords_for_df, DOMAIN_OPTIONS
+from utils.distribute import (
+    distribute_keywords, plan_dates, build_day_archive, build_account_archive, export_month_archive
+)
+from utils.generator import detect_columns, generate_keywords_for_rows, DOMAIN_OPTIONS
+from utils.reader import read_header, read_preview, count_rows, iter_rows
+from utils.downloads import publish_file, publish_dataframe_csv, download_url
 from PIL import Image
 from pathlib import Path
 from io import BytesIO
@@ -46,6 +50,23 @@ def get_available_platforms():
         platforms.append(p.stem)  # filename without extension
     return sorted(platforms)
 
+# Utility: download link served in chunks (Streamlit's static route, or the streaming
+# download server for files over its size cap). st.download_button would load the whole
+# file into memory on every rerun, so it is only used, on request, if neither is available.
+def download_link(label: str, path: str, file_name: str):
+    url = download_url(path, file_name)
+    if url is None:
+        if st.button(f"Prepare {file_name}", key=f"prepare_{path}"):
+            with open(path, "rb") as f:
+                st.download_button(label, f, file_name=file_name, key=f"download_{path}")
+        return
+    st.markdown(
+        f'<a href="{url}" download="{file_name}" target="_self" '
+        f'style="display:inline-block;padding:0.4rem 0.9rem;margin:0.2rem 0;border:1px solid rgba(128,128,128,0.4);'
+        f'border-radius:0.5rem;text-decoration:none;">{label}</a>',
+        unsafe_allow_html=True,
+    )
+
 # --- Merge Files Page ---
 if page == "Merge Files":
     st.header("🛠️ Merge Files")
@@ -59,6 +80,8 @@ if page == "Merge Files":
             st.warning("Please upload at least one CSV.")
         else:
             merged_counts = merge_uploaded_files(uploaded_files)
+            # Merged CSVs were rewritten, so any saved distribution plan is stale
+            st.session_state.pop("dist_result", None)
             if not merged_counts:
                 st.error("No recognizable platform files found. Please check filenames.")
             else:
@@ -86,8 +109,7 @@ if page == "Merge Files":
                 for platform in platforms:
                     merged_path = f"merged/{platform}.csv"
                     if os.path.exists(merged_path):
-                        with open(merged_path, "rb") as f:
-                            st.download_button(f"📥 Download {platform}.csv", f, file_name=f"{platform}.csv")
+                        download_link(f"📥 Download {platform}.csv", publish_file(merged_path), f"{platform}.csv")
 
 # --- Distribute Page ---
 if page == "Distribute Keywords":
@@ -110,111 +132,150 @@ if page == "Distribute Keywords":
         number_val = st.number_input("Accounts (type exact)", min_value=1, max_value=50, value=slider_val, step=1)
         accounts = int(number_val)  # use typed value as the source of truth
 
+    lazy = st.checkbox(
+        "Build day archives on demand",
+        value=True,
+        help="Only save the assignment plan now; each day's/account's ZIP is built when you pick it, and the monthly ZIP is an optional export.",
+    )
+
     if st.button("Distribute", type="primary"):
-        result = distribute_keywords(start_date, accounts=accounts, rows_per_account=100)
+        result = distribute_keywords(start_date, accounts=accounts, rows_per_account=100, lazy=lazy)
         if not result:
             st.warning("Distribution failed — ensure at least one merged CSV exists in the `merged/` folder.")
+            st.session_state.pop("dist_result", None)
         else:
-            st.success(f"✅ Distributed for **{result['days_distributed']}** day(s) across **{accounts}** account(s).")
-
-            # Stats row (metrics)
-            st.markdown("### Key Stats")
-            metrics_cols = st.columns(4)
-            total_platforms = len(result["platforms"])
-            total_distributed = sum(result.get(f"{p}_distributed", 0) for p in result["platforms"])
-            total_leftover = sum(result.get(f"remaining_{p}", 0) for p in result["platforms"])
-            metrics_cols[0].metric("Platforms", total_platforms)
-            metrics_cols[1].metric("Days", result["days_distributed"])
-            metrics_cols[2].metric("Total Distributed", total_distributed)
-            metrics_cols[3].metric("Total Leftover", total_leftover)
-
-            # Prepare data for charts
-            platforms = result["platforms"]
-            dist_counts = [result.get(f"{p}_distributed", 0) for p in platforms]
-            rem_counts = [result.get(f"remaining_{p}", 0) for p in platforms]
-
-            df_summary = pd.DataFrame({
-                "platform": platforms,
-                "distributed": dist_counts,
-                "leftover": rem_counts
-            })
-            df_long = df_summary.melt(id_vars="platform", value_vars=["distributed", "leftover"], var_name="type", value_name="rows")
-
-            # Daily distribution (per platform)
-            df_daily = pd.DataFrame(result["daily_distribution"])  # columns: date, platform columns with daily counts
-            # Ensure date is string for chart x-axis
-            if "date" in df_daily.columns:
-                df_daily["date"] = df_daily["date"].astype(str)
-
-            # Sunburst data: build (Date -> Platform -> Account) hierarchy using daily per-platform counts
-            # We simulate per-account rows from the day counts, splitting evenly (last account may be partial).
-            sun_rows = []
-            rows_per_account = result["rows_per_account"]
-            acc_n = result["accounts"]
-            for _, row in df_daily.iterrows():
-                date_str = row["date"]
-                for p in platforms:
-                    day_count = int(row.get(p, 0))
-                    if day_count <= 0:
-                        continue
-                    full_accounts = day_count // rows_per_account
-                    remainder = day_count % rows_per_account
-                    # Add full accounts
-                    for a in range(1, min(acc_n, full_accounts) + 1):
-                        sun_rows.append({"Date": date_str, "Platform": p, "Account": f"Account_{a:02d}", "Rows": rows_per_account})
-                    # Add remainder (if any) to next account
-                    next_acc = full_accounts + 1
-                    if remainder > 0 and next_acc <= acc_n:
-                        sun_rows.append({"Date": date_str, "Platform": p, "Account": f"Account_{next_acc:02d}", "Rows": remainder})
-
-            df_sun = pd.DataFrame(sun_rows) if sun_rows else pd.DataFrame(columns=["Date", "Platform", "Account", "Rows"])
-
-            # 2x2 dashboard
-            t1, t2 = st.columns(2)
-            with t1:
-                st.subheader("Distribution vs Leftover (Pie)")
-                pie2 = px.pie(df_long, names="platform", values="rows", color="type", hole=0.35)
-                st.plotly_chart(pie2, use_container_width=True)
-
-            with t2:
-                st.subheader("Sunburst: Date → Platform → Account")
-                if not df_sun.empty:
-                    sunb = px.sunburst(df_sun, path=["Date", "Platform", "Account"], values="Rows")
-                    st.plotly_chart(sunb, use_container_width=True)
+            # Persist so day/account pickers and downloads survive reruns
+            st.session_state["dist_result"] = result
+
+    if "dist_result" in st.session_state:
+        result = st.session_state["dist_result"]
+        st.success(f"✅ Distributed for **{result['days_distributed']}** day(s) across **{result['accounts']}** account(s).")
+
+        # Stats row (metrics)
+        st.markdown("### Key Stats")
+        metrics_cols = st.columns(4)
+        total_platforms = len(result["platforms"])
+        total_distributed = sum(result.get(f"{p}_distributed", 0) for p in result["platforms"])
+        total_leftover = sum(result.get(f"remaining_{p}", 0) for p in result["platforms"])
+        metrics_cols[0].metric("Platforms", total_platforms)
+        metrics_cols[1].metric("Days", result["days_distributed"])
+        metrics_cols[2].metric("Total Distributed", total_distributed)
+        metrics_cols[3].metric("Total Leftover", total_leftover)
+
+        # Prepare data for charts
+        platforms = result["platforms"]
+        dist_counts = [result.get(f"{p}_distributed", 0) for p in platforms]
+        rem_counts = [result.get(f"remaining_{p}", 0) for p in platforms]
+
+        df_summary = pd.DataFrame({
+            "platform": platforms,
+            "distributed": dist_counts,
+            "leftover": rem_counts
+        })
+        df_long = df_summary.melt(id_vars="platform", value_vars=["distributed", "leftover"], var_name="type", value_name="rows")
+
+        # Daily distribution (per platform)
+        df_daily = pd.DataFrame(result["daily_distribution"])  # columns: date, platform columns with daily counts
+        # Ensure date is string for chart x-axis
+        if "date" in df_daily.columns:
+            df_daily["date"] = df_daily["date"].astype(str)
+
+        # Sunburst data: build (Date -> Platform -> Account) hierarchy using daily per-platform counts
+        # We simulate per-account rows from the day counts, splitting evenly (last account may be partial).
+        sun_rows = []
+        rows_per_account = result["rows_per_account"]
+        acc_n = result["accounts"]
+        for _, row in df_daily.iterrows():
+            date_str = row["date"]
+            for p in platforms:
+                day_count = int(row.get(p, 0))
+                if day_count <= 0:
+                    continue
+                full_accounts = day_count // rows_per_account
+                remainder = day_count % rows_per_account
+                # Add full accounts
+                for a in range(1, min(acc_n, full_accounts) + 1):
+                    sun_rows.append({"Date": date_str, "Platform": p, "Account": f"Account_{a:02d}", "Rows": rows_per_account})
+                # Add remainder (if any) to next account
+                next_acc = full_accounts + 1
+                if remainder > 0 and next_acc <= acc_n:
+                    sun_rows.append({"Date": date_str, "Platform": p, "Account": f"Account_{next_acc:02d}", "Rows": remainder})
+
+        df_sun = pd.DataFrame(sun_rows) if sun_rows else pd.DataFrame(columns=["Date", "Platform", "Account", "Rows"])
+
+        # 2x2 dashboard
+        t1, t2 = st.columns(2)
+        with t1:
+            st.subheader("Distribution vs Leftover (Pie)")
+            pie2 = px.pie(df_long, names="platform", values="rows", color="type", hole=0.35)
+            st.plotly_chart(pie2, use_container_width=True)
+
+        with t2:
+            st.subheader("Sunburst: Date → Platform → Account")
+            if not df_sun.empty:
+                sunb = px.sunburst(df_sun, path=["Date", "Platform", "Account"], values="Rows")
+                st.plotly_chart(sunb, use_container_width=True)
+            else:
+                st.info("No sunburst data to show (no distributed rows).")
+
+        b1, b2 = st.columns(2)
+        with b1:
+            st.subheader("Daily Trend by Platform")
+            if not df_daily.empty:
+                # Line chart: one series per platform
+                y_cols = [c for c in df_daily.columns if c != "date"]
+                if y_cols:
+                    line = px.line(df_daily, x="date", y=y_cols, labels={"value": "Rows", "variable": "Platform"})
+                    st.plotly_chart(line, use_container_width=True)
                 else:
-                    st.info("No sunburst data to show (no distributed rows).")
-
-            b1, b2 = st.columns(2)
-            with b1:
-                st.subheader("Daily Trend by Platform")
-                if not df_daily.empty:
-                    # Line chart: one series per platform
-                    y_cols = [c for c in df_daily.columns if c != "date"]
-                    if y_cols:
-                        line = px.line(df_daily, x="date", y=y_cols, labels={"value": "Rows", "variable": "Platform"})
-                        st.plotly_chart(line, use_container_width=True)
-                    else:
-                        st.info("No platform columns found in daily distribution.")
+                    st.info("No platform columns found in daily distribution.")
+            else:
+                st.info("No daily distribution data.")
+
+        with b2:
+            st.subheader("Platform Summary")
+            st.dataframe(df_summary, use_container_width=True, hide_index=True)
+
+        # Per-day / per-account downloads (built on request, cached)
+        plan = result.get("plan")
+        dates = plan_dates(plan) if plan else []
+        if dates:
+            st.subheader("📅 Day / Account Downloads")
+            d1, d2 = st.columns(2)
+            day = d1.selectbox("Day", dates, key="dist_day")
+            account_label = d2.selectbox(
+                "Account", ["All accounts"] + [f"account_{a}" for a in range(1, plan["accounts"] + 1)], key="dist_account"
+            )
+            try:
+                if account_label == "All accounts":
+                    day_zip, download_name = build_day_archive(plan, day), f"{day}.zip"
                 else:
-                    st.info("No daily distribution data.")
+                    account = int(account_label.split("_")[1])
+                    day_zip, download_name = build_account_archive(plan, day, account), f"{day}_{account_label}.zip"
+                download_link(f"📥 Download {download_name}", publish_file(day_zip), download_name)
+            except ValueError as e:
+                st.error(str(e))
+
+        # Monthly ZIP: built up front in eager mode, exported on demand in lazy mode
+        if plan and not result.get("zip_path"):
+            if st.button("🗜️ Export monthly ZIP", key="dist_export"):
+                try:
+                    with st.spinner("Building monthly ZIP..."):
+                        result["zip_path"] = export_month_archive(plan)
+                except ValueError as e:
+                    st.error(str(e))
+
+        # ZIP download
+        if result.get("zip_path") and os.path.exists(result["zip_path"]):
+            download_link("📦 Download Distribution ZIP", publish_file(result["zip_path"]), os.path.basename(result["zip_path"]))
+
+        # Leftover downloads (only those that exist)
+        st.subheader("💾 Leftover Files")
+        for p in platforms:
+            leftover_path = result.get(f"{p}_download")
+            if leftover_path and os.path.exists(leftover_path):
+                download_link(f"Download leftover {p}.csv", publish_file(leftover_path), os.path.basename(leftover_path))
 
-            with b2:
-                st.subheader("Platform Summary")
-                st.dataframe(df_summary, use_container_width=True, hide_index=True)
-
-            # ZIP download
-            if result.get("zip_path") and os.path.exists(result["zip_path"]):
-                with open(result["zip_path"], "rb") as f:
-                    st.download_button("📦 Download Distribution ZIP", f, file_name=os.path.basename(result["zip_path"]))
-
-            # Leftover downloads (only those that exist)
-            st.subheader("💾 Leftover Files")
-            for p in platforms:
-                leftover_path = result.get(f"{p}_download")
-                if leftover_path and os.path.exists(leftover_path):
-                    with open(leftover_path, "rb") as f:
-                        st.download_button(f"Download leftover {p}.csv", f, file_name=os.path.basename(leftover_path))
-        
 
 
 # =========================
@@ -230,40 +291,47 @@ if page == "Keyword Generator":
         key="kg_upload"
     )
 
-    # If a new file is uploaded, clear previous generation results
+    # If a new file is uploaded, clear previous generation results and cached file info.
+    # file_id changes on every upload, so re-uploading an edited file with the same name counts as new.
     if uploaded_file is not None:
-        if st.session_state.get("kg_uploaded_name") != uploaded_file.name:
-            st.session_state["kg_uploaded_name"] = uploaded_file.name
-            for k in ("kg_final_df", "kg_stats", "kg_time_taken", "kg_perf"):
+        upload_key = (uploaded_file.name, getattr(uploaded_file, "file_id", None), uploaded_file.size)
+        if st.session_state.get("kg_upload_key") != upload_key:
+            st.session_state["kg_upload_key"] = upload_key
+            for k in ("kg_final_df", "kg_stats", "kg_time_taken", "kg_perf", "kg_columns", "kg_preview", "kg_row_count", "kg_csv_path"):
                 if k in st.session_state:
                     del st.session_state[k]
 
-    # Read file if uploaded
-    df = None
+    # Read only the header + first rows; the body is streamed at generation time
+    cols = None
     if uploaded_file:
-        name = uploaded_file.name.lower()
         try:
-            if name.endswith(".csv"):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            if "kg_columns" not in st.session_state or "kg_preview" not in st.session_state:
+                # Cache only once both reads succeed, so a bad file is re-reported on every rerun
+                header = read_header(uploaded_file)
+                preview = read_preview(uploaded_file, n_rows=5)
+                st.session_state["kg_columns"] = header
+                st.session_state["kg_preview"] = preview
+            cols = st.session_state["kg_columns"]
         except Exception as e:
             st.error(f"Failed to read file: {e}")
-            df = None
+            cols = None
 
     # Show file info + preview
-    if df is not None:
+    if cols is not None:
         st.subheader("📊 File Information")
         col1, col2, col3 = st.columns([1, 1, 3])
-        col1.metric("Rows", len(df))
-        col2.metric("Columns", len(df.columns))
-        col3.markdown("**Columns:** " + ", ".join([f"`{c}`" for c in df.columns]))
+        if "kg_row_count" in st.session_state:
+            col1.metric("Rows", st.session_state["kg_row_count"])
+        elif col1.button("Count rows", key="kg_count"):
+            st.session_state["kg_row_count"] = count_rows(uploaded_file)
+            col1.metric("Rows", st.session_state["kg_row_count"])
+        col2.metric("Columns", len(cols))
+        col3.markdown("**Columns:** " + ", ".join([f"`{c}`" for c in cols]))
 
         st.subheader("🔍 Preview (first 5 rows)")
-        st.dataframe(df.head(), use_container_width=True)
+        st.dataframe(st.session_state["kg_preview"], use_container_width=True)
 
-        # Detect columns
-        cols = list(df.columns)
+        # Detect columns from the header row alone
         title_col, link_col, keywords_col = detect_columns(cols)
 
         if not title_col:
@@ -279,6 +347,8 @@ if page == "Keyword Generator":
                     st.stop()
 
                 start_time = time.time()
+                if "kg_row_count" not in st.session_state:
+                    st.session_state["kg_row_count"] = count_rows(uploaded_file)
                 progress = st.progress(0, text="Generating keywords...")
 
                 def _cb(done, total):
@@ -289,12 +359,13 @@ if page == "Keyword Generator":
                         # fallback in case total==0
                         progress.progress(1.0)
 
-                final_df, stats = generate_keywords_for_df(
-                    df=df.copy(),
+                final_df, stats = generate_keywords_for_rows(
+                    rows=iter_rows(uploaded_file, [title_col, link_col, keywords_col]),
                     api_key=api_key,
                     title_col=title_col,
                     link_col=link_col,
                     keywords_col=keywords_col,
+                    total=st.session_state["kg_row_count"],
                     progress_cb=_cb,
                     delay_seconds=1.5,
                     retries=3
@@ -302,7 +373,7 @@ if page == "Keyword Generator":
 
                 time_taken = time.time() - start_time
                 api_calls = stats.get("generated", 0) + stats.get("failed", 0)
-                rows_total = len(df)
+                rows_total = len(final_df)
                 rows_per_sec_total = rows_total / time_taken if time_taken > 0 else 0.0
                 api_rows_per_sec = api_calls / time_taken if time_taken > 0 else 0.0
                 avg_ms_per_api_call = (time_taken / api_calls * 1000.0) if api_calls > 0 else None
@@ -310,6 +381,7 @@ if page == "Keyword Generator":
 
                 # Persist results in session_state so dropdowns / reruns won't clear them
                 st.session_state["kg_final_df"] = final_df
+                st.session_state.pop("kg_csv_path", None)
                 st.session_state["kg_stats"] = stats
                 st.session_state["kg_time_taken"] = time_taken
                 st.session_state["kg_perf"] = {
@@ -364,18 +436,15 @@ if page == "Keyword Generator":
         domain_label = st.selectbox("🌍 Save file for marketplace:", list(DOMAIN_OPTIONS.keys()), key="kg_domain")
         filename = DOMAIN_OPTIONS[domain_label]
 
-        csv_bytes = final_df.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label=f"📥 Download for {domain_label}",
-            data=csv_bytes,
-            file_name=filename,
-            mime="text/csv",
-            key="kg_download"
-        )
+        # Serialize once per generation; reruns (e.g. changing the marketplace) reuse the file
+        if not os.path.exists(st.session_state.get("kg_csv_path", "")):
+            st.session_state["kg_csv_path"] = publish_dataframe_csv(final_df, name="keywords.csv")
+        download_link(f"📥 Download for {domain_label}", st.session_state["kg_csv_path"], filename)
 
         # Allow clearing results
         if st.button("🧹 Clear generated results", key="kg_clear"):
-            for k in ("kg_final_df", "kg_stats", "kg_time_taken", "kg_perf", "kg_uploaded_name"):
+            for k in ("kg_final_df", "kg_stats", "kg_time_taken", "kg_perf", "kg_upload_key",
+                      "kg_columns", "kg_preview", "kg_row_count", "kg_csv_path"):
                 if k in st.session_state:
                     del st.session_state[k]
             st.experimental_rerun()
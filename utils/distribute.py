@@ -2,9 +2,31 @@ import pandas as pd
 import os
 from pathlib import Path
 import zipfile
+import hashlib
 import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import timedelta
 from calendar import monthrange
+from utils.downloads import unpublish_file
+
+MERGED_FOLDER = "merged"
+DISTRIBUTED_FOLDER = "distributed"
+LEFTOVER_FOLDER = "leftover"
+
+# Lazily built day/account archives kept on disk (least recently used are deleted first)
+ARCHIVE_CACHE_SIZE = 8
+_archive_cache: "OrderedDict[tuple, str]" = OrderedDict()
+# Streamlit runs each session in its own thread; guards _archive_cache and the cache folder
+_archive_lock = threading.Lock()
+_archive_building: "dict[tuple, threading.Lock]" = {}
+_archive_cache_cleared = False
+
+# Rows parsed per chunk when streaming merged CSVs
+CSV_CHUNK_ROWS = 10_000
 
 # Discover available platform CSVs in /merged dynamically
 def _discover_platforms(merged_folder: str) -> list[str]:
@@ -13,123 +35,272 @@ def _discover_platforms(merged_folder: str) -> list[str]:
         return []
     return sorted([f.stem for f in p.glob("*.csv")])
 
-def distribute_keywords(start_date, accounts: int = 23, rows_per_account: int = 100):
+@contextmanager
+def _replace_when_done(path: str):
     """
-    Distribute only the platforms that exist in merged/.
-    - accounts: number of accounts per day (user-chosen)
-    - rows_per_account: rows per account (fixed at 100 as per requirement)
-    Returns a dict with distribution results and paths.
+    Yield a temp path next to `path`; move it over `path` once written.
+    Readers of the previous file (e.g. a running download) keep the old contents.
     """
-    merged_folder = "merged"
-    distributed_folder = "distributed"
-    leftover_folder = "leftover"
-    os.makedirs(distributed_folder, exist_ok=True)
-    os.makedirs(leftover_folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    platforms = _discover_platforms(merged_folder)
+def _count_rows(path: str) -> int:
+    """Count data rows of a CSV without holding it in memory."""
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], chunksize=CSV_CHUNK_ROWS))
+
+def _read_rows(path: str, start: int, n_rows: int) -> pd.DataFrame:
+    """Read rows [start, start + n_rows) of a CSV, keeping its header."""
+    return pd.read_csv(path, skiprows=range(1, start + 1), nrows=n_rows)
+
+def _write_leftover(path: str, start: int, out_path: str) -> int:
+    """Stream rows [start:] of a CSV into out_path. Returns rows written."""
+    written = 0
+    with _replace_when_done(out_path) as tmp_path:
+        chunks = pd.read_csv(path, skiprows=range(1, start + 1), chunksize=CSV_CHUNK_ROWS)
+        for chunk in chunks:
+            chunk.to_csv(tmp_path, mode="w" if written == 0 else "a", header=written == 0, index=False)
+            written += len(chunk)
+    return written
+
+def plan_distribution(start_date, accounts: int = 23, rows_per_account: int = 100):
+    """
+    Work out which rows go to which day/account without writing any day files.
+    Returns a plan dict (platforms, start pointers, accounts, rows per account, days)
+    or False if there is nothing to distribute.
+    """
+    platforms = _discover_platforms(MERGED_FOLDER)
     if not platforms:
         return False
 
-    # Load only the available platforms
-    platform_dfs = {}
     total_rows = {}
-    pointers = {}
+    mtimes = {}
     for platform in platforms:
-        path = os.path.join(merged_folder, f"{platform}.csv")
-        if not os.path.exists(path):
-            # Shouldn't happen due to discovery, but safe-guard
-            continue
-        df = pd.read_csv(path)
-        platform_dfs[platform] = df
-        total_rows[platform] = len(df)
-        pointers[platform] = 0
-
-    if not platform_dfs:
-        return False
+        path = os.path.join(MERGED_FOLDER, f"{platform}.csv")
+        total_rows[platform] = _count_rows(path)
+        mtimes[platform] = os.path.getmtime(path)
 
     rows_per_day = accounts * rows_per_account
 
     # How many full days can we distribute across ALL included platforms?
     # (min across platforms so each day's folder has all included platforms)
-    def days_possible_for(n_rows: int) -> int:
-        return n_rows // rows_per_day
-
-    days_possible = min(days_possible_for(total_rows[p]) for p in platform_dfs.keys())
+    days_possible = min(total_rows[p] // rows_per_day for p in platforms)
     # Fit within the remaining days in the month from start_date
     total_days_in_month = monthrange(start_date.year, start_date.month)[1]
     remaining_days = total_days_in_month - start_date.day + 1
     days_to_distribute = min(days_possible, remaining_days)
 
-    daily_distribution = []
-
-    # Base folder (unzipped)
-    base = Path(distributed_folder) / f"{start_date.strftime('%Y-%m')}_distribution"
-    base.mkdir(parents=True, exist_ok=True)
-
-    # Distribute day by day
-    for offset in range(days_to_distribute):
-        curr_date = start_date + timedelta(days=offset)
-        day_folder = base / curr_date.strftime('%Y-%m-%d')
-        day_folder.mkdir(parents=True, exist_ok=True)
-
-        # Track daily counts per platform (for charts)
-        summary = {"date": curr_date.strftime('%Y-%m-%d')}
-
-        for acc in range(1, accounts + 1):
-            acc_folder = day_folder / f"account_{acc}"
-            acc_folder.mkdir(parents=True, exist_ok=True)
-            for platform, df in platform_dfs.items():
-                ptr = pointers[platform]
-                # Slice for this account
-                chunk = df.iloc[ptr:ptr + rows_per_account]
-                pointers[platform] += len(chunk)  # in case last partial day ever occurs
-                # Save file: {platform}_{MM-DD}.csv
-                out_name = f"{platform}_{curr_date.strftime('%m-%d')}.csv"
-                chunk.to_csv(acc_folder / out_name, index=False)
-
-        # Daily counts per platform (how many rows written this day)
-        for platform in platform_dfs.keys():
-            start_ptr = max(0, pointers[platform] - rows_per_day)
-            day_count = pointers[platform] - start_ptr
-            summary[platform] = day_count
-
-        daily_distribution.append(summary)
-
-    # Zip the distribution folder
-    zip_path = f"{distributed_folder}/{start_date.strftime('%Y-%m')}_distribution.zip"
-    with zipfile.ZipFile(zip_path, "w") as zf:
-        for root, _, files in os.walk(base):
-            for fname in files:
-                p = os.path.join(root, fname)
-                zf.write(p, os.path.relpath(p, start=base.parent))
-
-    # Remove the unzipped folder to keep only ZIP
-    shutil.rmtree(base, ignore_errors=True)
+    return {
+        "start_date": start_date,
+        "platforms": platforms,
+        "start_pointers": {p: 0 for p in platforms},
+        "accounts": accounts,
+        "rows_per_account": rows_per_account,
+        "days": days_to_distribute,
+        "total_rows": total_rows,
+        "mtimes": mtimes,
+    }
+
+def plan_dates(plan) -> list[str]:
+    """Dates (YYYY-MM-DD) covered by a plan."""
+    return [(plan["start_date"] + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(plan["days"])]
+
+def _plan_key(plan) -> tuple:
+    return (
+        plan["start_date"].isoformat(),
+        plan["accounts"],
+        plan["rows_per_account"],
+        tuple(sorted(plan["start_pointers"].items())),
+        tuple(sorted(plan["mtimes"].items())),
+    )
+
+def check_plan_current(plan):
+    """Raise ValueError if any merged CSV changed since the plan was made (e.g. after a re-merge)."""
+    for platform, mtime in plan["mtimes"].items():
+        path = os.path.join(MERGED_FOLDER, f"{platform}.csv")
+        if not os.path.exists(path) or os.path.getmtime(path) != mtime:
+            raise ValueError(
+                f"merged/{platform}.csv changed since this distribution was planned. Please distribute again."
+            )
+
+def _day_offset(plan, day: str) -> int:
+    dates = plan_dates(plan)
+    if day not in dates:
+        raise ValueError(f"{day} is not part of this distribution ({len(dates)} day(s) from {plan['start_date']}).")
+    return dates.index(day)
+
+def _write_day(zf: zipfile.ZipFile, plan, day: str, accounts: list[int], prefix: str = ""):
+    """Write one day's account files into an open ZIP, reading only that day's rows."""
+    offset = _day_offset(plan, day)
+    rpa = plan["rows_per_account"]
+    rows_per_day = plan["accounts"] * rpa
+    mm_dd = day[5:]
+    for platform in plan["platforms"]:
+        # Only the requested accounts' rows are read from the merged CSV
+        first, last = min(accounts), max(accounts)
+        start = plan["start_pointers"][platform] + offset * rows_per_day + (first - 1) * rpa
+        df = _read_rows(os.path.join(MERGED_FOLDER, f"{platform}.csv"), start, (last - first + 1) * rpa)
+        for acc in accounts:
+            lo = (acc - first) * rpa
+            chunk = df.iloc[lo:lo + rpa]
+            zf.writestr(f"{prefix}{day}/account_{acc}/{platform}_{mm_dd}.csv", chunk.to_csv(index=False))
+
+def _cached_archive(plan, key: tuple, name: str, build) -> str:
+    """
+    Return the path of a cached archive, building it (and evicting the LRU entry) if needed.
+    Only lookups and bookkeeping hold the shared lock; builds run under a per-key lock,
+    so a slow build never blocks other sessions' cache hits or other days.
+    """
+    global _archive_cache_cleared
+    check_plan_current(plan)
+    key = _plan_key(plan) + key
+    cache_dir = Path(DISTRIBUTED_FOLDER) / "cache"
+
+    with _archive_lock:
+        # Archives left by a previous process are not tracked, so start from an empty folder
+        if not _archive_cache_cleared:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            _archive_cache_cleared = True
+
+        path = _archive_cache.get(key)
+        if path and os.path.exists(path):
+            _archive_cache.move_to_end(key)
+            return path
+        key_lock = _archive_building.setdefault(key, threading.Lock())
+
+    with key_lock:
+        try:
+            # Another session may have built it while we waited
+            with _archive_lock:
+                path = _archive_cache.get(key)
+                if path and os.path.exists(path):
+                    _archive_cache.move_to_end(key)
+                    return path
+
+            # Unique per build, so an evicted copy is never confused with a fresh one
+            digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:10]
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            path = str(cache_dir / f"{name}_{digest}_{uuid.uuid4().hex[:8]}.zip")
+            with _replace_when_done(path) as tmp_path:
+                with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                    build(zf)
+
+            with _archive_lock:
+                _archive_cache[key] = path
+                while len(_archive_cache) > ARCHIVE_CACHE_SIZE:
+                    _, old_path = _archive_cache.popitem(last=False)
+                    # Drop the published download link too, so the cache size bounds disk use
+                    unpublish_file(old_path)
+                    if os.path.exists(old_path):
+                        os.remove(old_path)
+            return path
+        finally:
+            with _archive_lock:
+                _archive_building.pop(key, None)
+
+def build_day_archive(plan, day: str) -> str:
+    """Build (or reuse) the ZIP for one day: {day}/account_N/{platform}_{MM-DD}.csv"""
+    accounts = list(range(1, plan["accounts"] + 1))
+    return _cached_archive(plan, ("day", day), day, lambda zf: _write_day(zf, plan, day, accounts))
+
+def build_account_archive(plan, day: str, account: int) -> str:
+    """Build (or reuse) the ZIP for a single account on one day."""
+    if not 1 <= account <= plan["accounts"]:
+        raise ValueError(f"Account {account} is out of range (1-{plan['accounts']}).")
+    return _cached_archive(
+        plan, ("account", day, account), f"{day}_account_{account}",
+        lambda zf: _write_day(zf, plan, day, [account]),
+    )
+
+def export_month_archive(plan) -> str:
+    """
+    Build the full monthly ZIP on demand.
+    Merged CSVs are streamed one account slice at a time, so memory stays flat.
+    """
+    month = plan["start_date"].strftime('%Y-%m')
+    zip_path = f"{DISTRIBUTED_FOLDER}/{month}_distribution.zip"
+    prefix = f"{month}_distribution/"
+    rpa = plan["rows_per_account"]
+
+    check_plan_current(plan)
+    readers = {
+        p: pd.read_csv(
+            os.path.join(MERGED_FOLDER, f"{p}.csv"),
+            skiprows=range(1, plan["start_pointers"][p] + 1),
+            chunksize=rpa,
+        )
+        for p in plan["platforms"]
+    }
+    try:
+        with _replace_when_done(zip_path) as tmp_path:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for day in plan_dates(plan):
+                    mm_dd = day[5:]
+                    for acc in range(1, plan["accounts"] + 1):
+                        for platform, reader in readers.items():
+                            chunk = next(reader)
+                            zf.writestr(f"{prefix}{day}/account_{acc}/{platform}_{mm_dd}.csv", chunk.to_csv(index=False))
+    finally:
+        for reader in readers.values():
+            reader.close()
+    return zip_path
+
+def distribute_keywords(start_date, accounts: int = 23, rows_per_account: int = 100, lazy: bool = False):
+    """
+    Distribute only the platforms that exist in merged/.
+    - accounts: number of accounts per day (user-chosen)
+    - rows_per_account: rows per account (fixed at 100 as per requirement)
+    - lazy: only save the assignment plan; day/account archives are built on request
+      (build_day_archive / build_account_archive) and the monthly ZIP via export_month_archive.
+    Returns a dict with distribution results and paths.
+    """
+    os.makedirs(DISTRIBUTED_FOLDER, exist_ok=True)
+    os.makedirs(LEFTOVER_FOLDER, exist_ok=True)
+
+    plan = plan_distribution(start_date, accounts=accounts, rows_per_account=rows_per_account)
+    if not plan:
+        return False
+
+    platforms = plan["platforms"]
+    rows_per_day = accounts * rows_per_account
+    days_to_distribute = plan["days"]
+
+    # Every distributed day takes exactly rows_per_day rows from each platform
+    daily_distribution = [
+        {"date": day, **{p: rows_per_day for p in platforms}} for day in plan_dates(plan)
+    ]
+
+    zip_path = None if lazy else export_month_archive(plan)
 
     # Leftovers per platform
+    pointers = {p: plan["start_pointers"][p] + days_to_distribute * rows_per_day for p in platforms}
     leftover_paths = {}
-    for platform, df in platform_dfs.items():
-        ptr = pointers[platform]
-        leftover_df = df.iloc[ptr:]
+    for platform in platforms:
         leftover_path = None
-        if not leftover_df.empty:
-            leftover_path = os.path.join(leftover_folder, f"undistributed_{platform}.csv")
-            leftover_df.to_csv(leftover_path, index=False)
+        if pointers[platform] < plan["total_rows"][platform]:
+            leftover_path = os.path.join(LEFTOVER_FOLDER, f"undistributed_{platform}.csv")
+            _write_leftover(os.path.join(MERGED_FOLDER, f"{platform}.csv"), pointers[platform], leftover_path)
         leftover_paths[platform] = leftover_path
 
     # Build result
     result = {
-        "platforms": list(platform_dfs.keys()),
+        "platforms": platforms,
         "days_distributed": days_to_distribute,
         "zip_path": zip_path,
         "daily_distribution": daily_distribution,
         "accounts": accounts,
         "rows_per_account": rows_per_account,
+        "plan": plan,
     }
 
-    for platform in platform_dfs.keys():
+    for platform in platforms:
         result[f"{platform}_distributed"] = pointers[platform]
-        result[f"remaining_{platform}"] = total_rows[platform] - pointers[platform]
+        result[f"remaining_{platform}"] = plan["total_rows"][platform] - pointers[platform]
         result[f"{platform}_download"] = leftover_paths[platform]
 
     return result
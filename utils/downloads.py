@@ -0,0 +1,150 @@
+# utils/downloads.py
+import os
+import time
+import shutil
+import hashlib
+import uuid
+import threading
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote, unquote, urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+# Served by Streamlit's static file handler (server.enableStaticServing), which
+# streams files in fixed-size chunks instead of loading them into memory.
+# Streamlit serves app/static/ from the folder next to the main script, not the cwd.
+STATIC_FOLDER = Path(__file__).resolve().parent.parent / "static"
+DOWNLOADS_FOLDER = STATIC_FOLDER / "downloads"
+STATIC_URL_PREFIX = "./app/static"
+
+# Streamlit answers 404 for static files above this size
+# (MAX_APP_STATIC_FILE_SIZE in streamlit/web/server/app_static_file_handler.py)
+STATIC_MAX_FILE_SIZE = 200 * 1024 * 1024
+
+# Files above STATIC_MAX_FILE_SIZE are streamed by a small HTTP server started once per
+# process. KG_DOWNLOAD_URL is its browser-facing address (set it when behind a proxy).
+DOWNLOAD_SERVER_HOST = os.environ.get("KG_DOWNLOAD_HOST", "0.0.0.0")
+DOWNLOAD_SERVER_PORT = int(os.environ.get("KG_DOWNLOAD_PORT", "8599"))
+DOWNLOAD_SERVER_URL = os.environ.get("KG_DOWNLOAD_URL", f"http://localhost:{DOWNLOAD_SERVER_PORT}").rstrip("/")
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_download_server = None
+_download_server_lock = threading.Lock()
+
+# Published files older than this are removed on the next publish
+DOWNLOAD_MAX_AGE_SECONDS = 24 * 60 * 60
+
+# Rows written per chunk when serializing a DataFrame to CSV
+CSV_CHUNK_ROWS = 10_000
+
+def static_url(path: str) -> Optional[str]:
+    """
+    URL for a file under the static folder, or None if Streamlit cannot serve it
+    (outside the static folder, or larger than STATIC_MAX_FILE_SIZE).
+    """
+    p = Path(path).resolve()
+    if STATIC_FOLDER not in p.parents or p.stat().st_size > STATIC_MAX_FILE_SIZE:
+        return None
+    return f"{STATIC_URL_PREFIX}/{p.relative_to(STATIC_FOLDER).as_posix()}"
+
+class _DownloadHandler(BaseHTTPRequestHandler):
+    """Serve GET /downloads/<token>/<name> from DOWNLOADS_FOLDER in fixed-size chunks."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = unquote(url.path).strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "downloads" or parts[1] in ("", ".", "..") or parts[2] in ("", ".", ".."):
+            self.send_error(404)
+            return
+        path = DOWNLOADS_FOLDER / parts[1] / parts[2]
+        if not path.is_file():
+            self.send_error(404)
+            return
+        file_name = parse_qs(url.query).get("filename", [parts[2]])[0]
+        with open(path, "rb") as f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(file_name)}")
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, STREAM_CHUNK_BYTES)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_download_server() -> bool:
+    """Start the streaming download server (once per process). Returns False if it cannot bind."""
+    global _download_server
+    with _download_server_lock:
+        if _download_server is None:
+            try:
+                _download_server = ThreadingHTTPServer((DOWNLOAD_SERVER_HOST, DOWNLOAD_SERVER_PORT), _DownloadHandler)
+            except OSError:
+                return False
+            _download_server.daemon_threads = True
+            threading.Thread(target=_download_server.serve_forever, daemon=True).start()
+        return True
+
+def download_url(path: str, file_name: str) -> Optional[str]:
+    """
+    URL for a published file: Streamlit's static route when the file fits under
+    STATIC_MAX_FILE_SIZE, otherwise the streaming download server.
+    None if neither can serve it.
+    """
+    url = static_url(path)
+    if url is not None:
+        return url
+    p = Path(path).resolve()
+    if DOWNLOADS_FOLDER not in p.parents or not start_download_server():
+        return None
+    return f"{DOWNLOAD_SERVER_URL}/downloads/{quote(p.relative_to(DOWNLOADS_FOLDER).as_posix())}?filename={quote(file_name)}"
+
+def prune_downloads(max_age_seconds: int = DOWNLOAD_MAX_AGE_SECONDS):
+    """Delete published download folders that have not been touched for max_age_seconds."""
+    if not DOWNLOADS_FOLDER.exists():
+        return
+    cutoff = time.time() - max_age_seconds
+    for folder in DOWNLOADS_FOLDER.iterdir():
+        if folder.is_dir() and folder.stat().st_mtime < cutoff:
+            shutil.rmtree(folder, ignore_errors=True)
+
+def _publish_token(path: str) -> str:
+    info = os.stat(path)
+    return hashlib.sha1(f"{os.path.abspath(path)}:{info.st_mtime_ns}:{info.st_size}".encode("utf-8")).hexdigest()[:16]
+
+def unpublish_file(path: str):
+    """Remove the published copy of `path` (if any), e.g. when the source is evicted from a cache."""
+    if os.path.exists(path):
+        shutil.rmtree(DOWNLOADS_FOLDER / _publish_token(path), ignore_errors=True)
+
+def publish_file(path: str) -> str:
+    """
+    Expose an existing file under the static downloads folder and return the published path.
+    Hard-links when possible (no copy), otherwise copies in chunks. Writers replace their
+    outputs with os.replace, so a published link never sees a half-rewritten file.
+    Publishing the same unchanged file again reuses the existing entry.
+    """
+    token = _publish_token(path)
+    folder = DOWNLOADS_FOLDER / token
+    target = folder / os.path.basename(path)
+    if target.exists():
+        os.utime(folder)
+        return str(target)
+
+    prune_downloads()
+    folder.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return str(target)
+
+def publish_dataframe_csv(df: pd.DataFrame, name: str = "output.csv") -> str:
+    """Write df to a static CSV once (in chunks) and return the published path."""
+    prune_downloads()
+    folder = DOWNLOADS_FOLDER / uuid.uuid4().hex[:16]
+    folder.mkdir(parents=True, exist_ok=True)
+    target = folder / name
+    df.to_csv(target, index=False, chunksize=CSV_CHUNK_ROWS)
+    return str(target)
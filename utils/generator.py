@@ -2,7 +2,7 @@
 import requests
 import time
 import pandas as pd
-from typing import Optional, Tuple, List, Dict
+from typing import Optional, Tuple, List, Dict, Iterable, Any
 
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 MODEL_NAME = "meta-llama/llama-4-maverick-17b-128e-instruct"
@@ -73,62 +73,84 @@ def _generate_keyword_one(title: str, api_key: str, retries: int = 3, delay: flo
             time.sleep(delay * (attempt + 1))
     return "ERROR: Max retries exceeded"
 
-def generate_keywords_for_df(
-    df: pd.DataFrame,
+def _cell_str(value) -> str:
+    """Stringify a cell, treating missing values (None/NaN) as empty."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    return str(value)
+
+def generate_keywords_for_rows(
+    rows: Iterable[Dict[str, Any]],
     api_key: str,
     title_col: Optional[str],
     link_col: Optional[str],
     keywords_col: Optional[str],
+    total: Optional[int] = None,
     progress_cb=None,
     delay_seconds: float = 1.5,
     retries: int = 3,
 ) -> Tuple[pd.DataFrame, Dict[str, int]]:
     """
-    Generate keywords row-by-row. If keywords column missing, create it.
+    Generate keywords for a stream of row dicts (e.g. from utils.reader.iter_rows).
+    - Only the Keywords[, Links] output values are kept in memory.
     - Skips rows where keywords already exist/non-empty.
-    - Returns final_df (Keywords[, Links]) and stats dict.
+    - total is only used for progress reporting; pass None if unknown.
+    Returns final_df (Keywords[, Links]) and stats dict.
     """
-    # Ensure keywords column exists
-    if not keywords_col:
-        keywords_col = "Keywords"
-        if "Keywords" not in df.columns:
-            df["Keywords"] = ""
-    # Make it string type to avoid dtype issues
-    df[keywords_col] = df[keywords_col].astype("object")
-
-    total = len(df)
+    keywords, links = [], []
     generated = failed = skipped = 0
 
-    for i in range(total):
-        title = str(df.at[i, title_col]) if title_col in df.columns else ""
-        existing = str(df.at[i, keywords_col]) if keywords_col in df.columns else ""
+    for i, row in enumerate(rows):
+        title = _cell_str(row.get(title_col)) if title_col else ""
+        existing = _cell_str(row.get(keywords_col)) if keywords_col else ""
         if title and (existing.strip() == "" or existing.strip().lower().startswith("error")):
             kw = _generate_keyword_one(title, api_key=api_key, retries=retries, delay=delay_seconds)
-            df.at[i, keywords_col] = kw
             if kw.startswith("ERROR"):
                 failed += 1
             else:
                 generated += 1
             time.sleep(delay_seconds)  # gentle rate limiting
         else:
+            kw = existing
             skipped += 1
+        keywords.append(kw)
+        if link_col:
+            links.append(row.get(link_col))
         if progress_cb:
-            progress_cb(i + 1, total)
-
-    # Build final distributor-ready frame
-    cols = []
-    # Put Keywords first
-    cols.append(keywords_col)
-    # Then Links if present
-    if link_col and link_col in df.columns:
-        cols.append(link_col)
+            progress_cb(i + 1, total or i + 1)
 
-    final_df = df[cols].copy()
-    # Standardize column names: Keywords[, Links]
-    final_df.rename(columns={keywords_col: "Keywords"}, inplace=True)
-    if link_col and link_col in final_df.columns:
-        final_df.rename(columns={link_col: "Links"}, inplace=True)
+    # Build final distributor-ready frame: Keywords[, Links]
+    data = {"Keywords": keywords}
+    if link_col:
+        data["Links"] = links
+    final_df = pd.DataFrame(data)
 
     stats = {"generated": generated, "failed": failed, "skipped": skipped}
     return final_df, stats
 
+def generate_keywords_for_df(
+    df: pd.DataFrame,
+    api_key: str,
+    title_col: Optional[str],
+    link_col: Optional[str],
+    keywords_col: Optional[str],
+    progress_cb=None,
+    delay_seconds: float = 1.5,
+    retries: int = 3,
+) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Generate keywords row-by-row for an in-memory DataFrame.
+    Thin wrapper over generate_keywords_for_rows.
+    """
+    cols = [c for c in (title_col, link_col, keywords_col) if c and c in df.columns]
+    return generate_keywords_for_rows(
+        rows=df[cols].to_dict("records"),
+        api_key=api_key,
+        title_col=title_col if title_col in df.columns else None,
+        link_col=link_col if link_col in df.columns else None,
+        keywords_col=keywords_col if keywords_col in df.columns else None,
+        total=len(df),
+        progress_cb=progress_cb,
+        delay_seconds=delay_seconds,
+        retries=retries,
+    )
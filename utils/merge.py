@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+import tempfile
 from pathlib import Path
 
 # Recognized platforms (lowercase substrings to match in filenames)
@@ -41,7 +42,11 @@ def merge_uploaded_files(uploaded_files):
         out_path = Path("merged") / f"{platform}.csv"
         if dfs:
             merged_df = pd.concat(dfs, ignore_index=True)
-            merged_df.to_csv(out_path, index=False)
+            # Write aside and swap in, so downloads of the previous file are not affected
+            fd, tmp_path = tempfile.mkstemp(dir="merged", suffix=".tmp")
+            os.close(fd)
+            merged_df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, out_path)
             merged_counts[platform] = len(merged_df)
         else:
             # If no upload for this platform in this run, do not touch existing files.
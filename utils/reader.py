@@ -0,0 +1,97 @@
+# utils/reader.py
+import pandas as pd
+from typing import Iterator, List, Dict, Any
+from openpyxl import load_workbook
+
+# Rows parsed per CSV chunk when streaming an upload
+CSV_CHUNK_ROWS = 10_000
+
+def _is_csv(uploaded_file) -> bool:
+    return getattr(uploaded_file, "name", "").lower().endswith(".csv")
+
+def _excel_header(raw: tuple) -> List[str]:
+    """Name header cells the way pandas does (blank -> 'Unnamed: i', duplicates -> 'name.1')."""
+    names, seen = [], {}
+    for i, cell in enumerate(raw):
+        name = f"Unnamed: {i}" if cell is None or str(cell).strip() == "" else str(cell)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _iter_excel(uploaded_file) -> Iterator[tuple]:
+    """
+    Yield (header, *rows) from the first sheet in openpyxl read-only mode.
+    Fully blank rows are skipped; the workbook is closed when iteration ends.
+    """
+    uploaded_file.seek(0)
+    wb = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _excel_header(header)
+        yield columns
+        width = len(columns)
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            yield row
+    finally:
+        wb.close()
+
+def read_header(uploaded_file) -> List[str]:
+    """Return the column names of an uploaded CSV/XLSX without parsing its body."""
+    if _is_csv(uploaded_file):
+        uploaded_file.seek(0)
+        return list(pd.read_csv(uploaded_file, nrows=0).columns)
+    rows = _iter_excel(uploaded_file)
+    try:
+        return next(rows, [])
+    finally:
+        rows.close()
+
+def read_preview(uploaded_file, n_rows: int = 5) -> pd.DataFrame:
+    """Return the first n_rows of an uploaded CSV/XLSX as a DataFrame."""
+    if _is_csv(uploaded_file):
+        uploaded_file.seek(0)
+        return pd.read_csv(uploaded_file, nrows=n_rows)
+    rows = _iter_excel(uploaded_file)
+    try:
+        columns = next(rows, [])
+        body = [row for _, row in zip(range(n_rows), rows)]
+    finally:
+        rows.close()
+    return pd.DataFrame(body, columns=columns)
+
+def count_rows(uploaded_file) -> int:
+    """Count data rows (header excluded) by streaming through the upload."""
+    if _is_csv(uploaded_file):
+        uploaded_file.seek(0)
+        return sum(len(chunk) for chunk in pd.read_csv(uploaded_file, usecols=[0], chunksize=CSV_CHUNK_ROWS))
+    rows = _iter_excel(uploaded_file)
+    next(rows, None)  # header
+    return sum(1 for _ in rows)
+
+def iter_rows(uploaded_file, columns: List[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream rows of an uploaded CSV/XLSX as dicts holding only `columns`.
+    CSVs are parsed in chunks of CSV_CHUNK_ROWS; XLSX files row by row.
+    """
+    columns = [c for c in columns if c]
+    if _is_csv(uploaded_file):
+        uploaded_file.seek(0)
+        for chunk in pd.read_csv(uploaded_file, usecols=columns, chunksize=CSV_CHUNK_ROWS):
+            yield from chunk[columns].to_dict("records")
+        return
+    rows = _iter_excel(uploaded_file)
+    header = next(rows, [])
+    idx = [header.index(c) for c in columns]
+    for row in rows:
+        yield {c: row[i] for c, i in zip(columns, idx)}